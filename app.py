@@ -1,15 +1,51 @@
 """A RESTful CRUD API for a graph with endpoints for nodes and edges"""
 
-from bleach import clean
 from flasgger import Swagger
-from flask import Flask, request
+from flask import Flask, g, has_app_context, has_request_context, request, stream_with_context
+from flask.json import JSONDecoder, JSONEncoder
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from functools import wraps
+import orjson
 import os
 import re
+import secrets
+import time
+from psycopg2.errors import UniqueViolation
+import redis
+from sqlalchemy import bindparam, event
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import Session
 from sqlalchemy.schema import CheckConstraint
+from sqlalchemy.util import LRUCache
+
+
+class OrjsonEncoder(JSONEncoder):
+    """Encode JSON with orjson wherever Flask does (e.g. jsonify), falling back on Flask's default for other types.
+    Flask 1.1 has no JSON provider to replace, so the encoder and decoder classes are replaced instead.
+    """
+    def encode(self, o):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME  # So default() formats dates as before
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(o, default=self.default, option=option).decode()
+        except orjson.JSONEncodeError:
+            return super().encode(o)  # e.g. an int too large for orjson (beyond 64 bits)
+
+
+class OrjsonDecoder(JSONDecoder):
+    """Decode JSON with orjson wherever Flask does (e.g. request.get_json)."""
+    def decode(self, s):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json_encoder = OrjsonEncoder
+app.json_decoder = OrjsonDecoder
 
 # Use flasgger to automatically render and serve OpenAPI documentation (from comments in each route)
 # Create an APISpec
@@ -98,18 +134,49 @@ swagger_template = {
 
 swagger = Swagger(app, template=swagger_template)
 
-CORS(app)  # Allow all CORS origins for all routes
+# Allow all CORS origins for all routes. Flask answers preflight (OPTIONS) requests without calling the view, and
+# browsers can reuse a preflight response for a day.
+CORS(app, max_age=86400)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = 'False'
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+# Keep connections to Postgres open between requests (for each gunicorn worker, shared by its requests).
+# gunicorn.conf.py sets DATABASE_POOL_SIZE, so that the pools of all the workers fit within Postgres' connection limit.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 20)),
+    'max_overflow': 0,
+    'pool_pre_ping': True,  # Replace connections which were closed by the server
+    'pool_recycle': 1800,  # Seconds
+    # Reuse the SQL compiled for the module-level statements (e.g. select_nodes) instead of compiling it every time.
+    # An LRU cache, as a new key is added for each statement built inside a request.
+    'execution_options': {'compiled_cache': LRUCache(100)}
+}
 db = SQLAlchemy(app)
 
+# Optional Redis cache for read endpoints (e.g. the Heroku Redis add-on), shared between workers.
+# If REDIS_URL is not set, responses are only cached in process memory.
+cache = redis.Redis.from_url(os.environ['REDIS_URL']) if os.environ.get('REDIS_URL') else None
+GRAPH_CACHE_KEY = 'graph:v0'
+GRAPH_CACHE_TTL = 60  # Seconds
+GRAPH_VERSION_KEY = 'graph:ver'
+GRAPH_EPOCH_KEY = 'graph:epoch'  # A random prefix for the version, replaced if Redis loses the version counter
+CACHE_MAX_BYTES = 16 * 1024 * 1024  # Larger streamed responses are not cached, so their memory use stays bounded
+graph_memo = (None, 0, None)  # The (graph version, expiry time, graph) most recently read by get_graph
+response_memo = {}  # Cache key -> (graph version, expiry time, response body) most recently served by cache_response
+BULK_BATCH_SIZE = 1000  # Rows per INSERT statement when creating many nodes or edges
+STREAM_BATCH_SIZE = 1000  # Rows fetched (and encoded) at a time when streaming the graph
+
 
 # Define the schema
 class Node(db.Model):
-    """A SQLAlchemy Class for storing nodes in Postgres."""
+    """A SQLAlchemy Class for storing nodes in Postgres.
+    Names are unique, using a partial index which excludes the (many) nodes without a name.
+    """
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), unique=True, nullable=True, index=True)
-    color = db.Column(db.String(7), unique=False, nullable=True, index=True)
+    name = db.Column(db.String(80), nullable=True)
+    color = db.Column(db.String(7), unique=False, nullable=True, index=False)
+    __table_args__ = (
+        db.Index('ix_node_name', 'name', unique=True, postgresql_where=db.text('name IS NOT NULL')),
+    )
     def __repr__(self):
         return f'<Node {self.id}'
 
@@ -118,13 +185,13 @@ class Edge(db.Model):
     """A SQLAlchemy Class for storing edges in Postgres.
     A CheckConstraint is applied to ensure that no edges are self-references (a node with an edge to itself)
     An edge is from a source node (sid) to a target node (tid)
+    Names are unique, using a partial index which excludes the (many) edges without a name.
     """
     id = db.Column(db.Integer, primary_key=True)
     sid = db.Column(
         db.Integer,
         db.ForeignKey('node.id', ondelete='CASCADE', onupdate='CASCADE'),
-        nullable=False,
-        index=True
+        nullable=False  # Indexed by ix_edge_sid_tid, as its first column
     )
     tid = db.Column(
         db.Integer,
@@ -132,44 +199,362 @@ class Edge(db.Model):
         nullable=False,
         index=True
     )
-    name = db.Column(db.String(80), unique=True, nullable=True, index=True)
-    color = db.Column(db.String(7), unique=False, nullable=True, index=True)
-    __table_args__ = (CheckConstraint('sid != tid'),)  # <- Comma required as __table_args__ is a tuple
+    name = db.Column(db.String(80), nullable=True)
+    color = db.Column(db.String(7), unique=False, nullable=True, index=False)
+    __table_args__ = (
+        CheckConstraint('sid != tid'),
+        db.Index('ix_edge_sid_tid', 'sid', 'tid'),  # For finding the edges between two nodes
+        db.Index('ix_edge_name', 'name', unique=True, postgresql_where=db.text('name IS NOT NULL'))
+    )
     def __repr__(self):
         return f'<Edge {self.sid} {self.tid}'
 
 
+# A counter bumped after every change to nodes or edges (shared by all worker processes) if Redis is not configured
+graph_version_seq = db.Sequence('graph_version_seq', metadata=db.Model.metadata)
+
+
+# Build the statements used by every request once. Baked queries also cache their compiled SQL.
+bakery = baked.bakery()
+node_ids_in = bakery(lambda s: s.query(Node.id).filter(Node.id.in_(bindparam('ids', expanding=True))))
+# stream_results uses a server-side cursor, so rows are fetched from Postgres as they are needed
+select_nodes = db.select([Node.id, Node.name, Node.color]).execution_options(stream_results=True)
+select_edges = db.select([Edge.id, Edge.sid, Edge.tid, Edge.name, Edge.color]).execution_options(stream_results=True)
+next_graph_version = db.text("SELECT nextval('graph_version_seq')")
+select_graph_version = db.text('SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM graph_version_seq')
+next_node_ids = db.text("SELECT nextval('node_id_seq') FROM generate_series(1, :n)")
+
+
+# Characters removed from strings in requests, to prevent XSS if they are ever rendered as HTML
+UNSAFE_CHARACTERS = re.compile(r'[<>"\'`]')
+# A hex color (with or without the # character). This only matches safe characters, so colors are not sanitized.
+COLOR = re.compile('^#?(([A-Fa-f0-9]{6}|[A-Fa-f0-9]{3}))$')
+
+
+MISSING = object()  # A default for dict.get, to tell a missing key apart from a key with the value None
+
+# Error messages, completed with % formatting when they are returned
+NO_NODE = 'Sorry, there is no node with id %s'
+NO_EDGE = 'Sorry, there is no edge with id %s'
+NODE_DELETED = 'There is no node with id=%s. Perhaps it has already been deleted?'
+EDGE_DELETED = 'There is no edge with id=%s. Perhaps it has already been deleted?'
+DUPLICATE_NODE = "Sorry, a node with the name '%s' already exists. Please change the name and try again."
+DUPLICATE_EDGE = "Sorry, an edge with the name '%s' already exists. Please change the name and try again."
+DUPLICATE_NAME = 'Sorry, a name is already used by another %s. Please change the name and try again.'
+EXCEPTION = 'Sorry, there was an exception: %s'
+NOT_AN_OBJECT = 'Sorry, the request body must be a JSON object.'
+
+
+def sanitize(string):
+    """Return a string from a request without any unsafe characters (or None if it is empty)."""
+    if not string:
+        return None
+    return UNSAFE_CHARACTERS.sub('', string)[:80] or None  # Names are stored in String(80) columns
+
+
 def valid_color(string):
     if not string:
         return None
-    match = re.match('^#?(([A-Fa-f0-9]{6}|[A-Fa-f0-9]{3}))$', string)
+    match = COLOR.match(string)
     if match:
         return f'#{match.group(1)}'
     return None
 
 
+def missing_node_ids(ids):
+    """Return a sorted list of the ids which are not the id of any node (checked with a single query)."""
+    ids = set(ids)
+    if not ids:
+        return []
+    found = {r[0] for r in node_ids_in(db.session()).params(ids=list(ids))}
+    return sorted(ids - found)
+
+
+def node_dict(node):
+    """Return a node in the format required by vue-d3 network in the frontend."""
+    return {'id': node.id, 'name': node.name, '_color': node.color}
+
+
+def edge_dict(edge):
+    """Return an edge in the format required by vue-d3 network in the frontend."""
+    return {'id': edge.id, 'sid': edge.sid, 'tid': edge.tid, 'name': edge.name, '_color': edge.color}
+
+
+def request_data():
+    """Return the JSON object in the request body ({} if there is no body), or None if the body is not a JSON object."""
+    if not request.get_data():
+        return {}
+    data = request.get_json(force=True, silent=True)
+    return data if isinstance(data, dict) else None
+
+
+NAME_INDEXES = {'ix_node_name': 'node', 'ix_edge_name': 'edge'}  # The unique indexes on names, and their tables
+
+
+def duplicate_name_response(e, message=None):
+    """Roll back and return a 400 response for an IntegrityError from a unique name index (re-raising any other,
+    e.g. a primary key which collides with a row created with an explicit id).
+    The message (by default DUPLICATE_NAME, naming the table of the index) can be given, e.g. to include the name.
+    """
+    db.session.rollback()
+    constraint = e.orig.diag.constraint_name if isinstance(e.orig, UniqueViolation) else None
+    if constraint in NAME_INDEXES:
+        return message or DUPLICATE_NAME % NAME_INDEXES[constraint], 400
+    raise e
+
+
+def json_response(data, status=200, headers=None):
+    """Return a JSON response encoded with orjson, which is much faster than the standard library encoder."""
+    return app.response_class(orjson.dumps(data), status=status, headers=headers, mimetype='application/json')
+
+
+def mutation_response(body, status, headers=None):
+    """Return the response to a change to a node or edge, or the entire graph if the request has ?full=1."""
+    if request.args.get('full') == '1':
+        return json_response(get_graph(), 200 if status == 204 else status, headers)
+    if status == 204:
+        return body, status, headers
+    return json_response(body, status, headers)
+
+
+def graph_version():
+    """Return a version string which changes whenever nodes or edges change (None if it cannot be read).
+    The version is read at most once per request, from Redis or (if Redis is not configured) from Postgres.
+    """
+    if g.pop('graph_changed', False):
+        bump_graph_version()
+    if 'graph_version' not in g:
+        if cache is None:
+            try:
+                g.graph_version = str(db.session.execute(select_graph_version).scalar())
+            except SQLAlchemyError:
+                app.logger.exception('Could not read the graph version')
+                db.session.rollback()  # So the request can still use the session
+                g.graph_version = None
+        else:
+            try:
+                epoch, counter = cache.mget(GRAPH_EPOCH_KEY, GRAPH_VERSION_KEY)
+                if epoch is None or counter is None:
+                    epoch, counter = new_graph_epoch()
+                g.graph_version = f'{epoch.decode()}.{counter.decode()}'
+            except redis.RedisError:
+                g.graph_version = None
+    return g.graph_version
+
+
+def new_graph_epoch():
+    """Start a new epoch for the graph version in Redis (e.g. after Redis lost its data) and return the
+    (epoch, counter). The version includes the epoch, so a version from before is never reused for different data.
+    """
+    with cache.pipeline() as pipe:
+        pipe.set(GRAPH_VERSION_KEY, 1, nx=True)  # Not 0, so INCR only returns 1 for a missing counter
+        pipe.set(GRAPH_EPOCH_KEY, secrets.token_hex(8))
+        pipe.mget(GRAPH_EPOCH_KEY, GRAPH_VERSION_KEY)
+        return pipe.execute()[-1]
+
+
+@event.listens_for(Session, 'after_commit')
+def graph_changed(session):
+    """Bump the graph version after every commit (each one changes nodes or edges).
+    The cached graph is keyed by version, so this also invalidates it.
+    No SQL can be run in an after_commit event, so in a request the version is bumped (with the request's own
+    connection) before it is next read or the response is sent.
+    """
+    if has_app_context():
+        g.pop('graph_version', None)
+    if has_request_context():
+        g.graph_changed = True
+    else:
+        bump_graph_version(db.engine)  # e.g. a script or flask shell, which has no response to wait for
+
+
+@app.after_request
+def graph_changed_response(response):
+    """Bump the graph version before sending the response to a request which changed nodes or edges."""
+    if g.pop('graph_changed', False):
+        bump_graph_version()
+    return response
+
+
+def bump_graph_version(bind=None):
+    """Bump the graph version in Redis or (if Redis is not configured) with bind (by default the request's session).
+    The changes are already committed, so an error is logged rather than raised (which would make the request fail).
+    """
+    try:
+        if cache is None:
+            (bind or db.session).execute(next_graph_version)  # nextval is not transactional, so needs no commit
+        elif cache.incr(GRAPH_VERSION_KEY) == 1:
+            new_graph_epoch()  # The counter was missing (e.g. evicted), so its old values must not be reused
+    except SQLAlchemyError:
+        app.logger.exception('Could not bump the graph version')
+        if bind is None:
+            db.session.rollback()  # So the request can still use the session
+    except redis.RedisError:
+        app.logger.exception('Could not bump the graph version')  # Any cached graph will expire after GRAPH_CACHE_TTL
+
+
+@app.before_first_request
+def create_graph_version_seq():
+    """Create the graph version sequence (in each worker) if the database was created before it was in the schema."""
+    if cache is None:
+        try:
+            graph_version_seq.create(db.engine, checkfirst=True)
+        except SQLAlchemyError:
+            # e.g. another worker created it at the same time. If it is missing, graph_version() returns None.
+            app.logger.exception('Could not create graph_version_seq')
+
+
+def cache_response(key, ttl):
+    """Decorate a view so a successful response is served from (and stored in) the cache.
+    The response body is kept in process memory for the current graph version, and in Redis if it is configured.
+    If the graph version cannot be read, the view is called as normal.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = graph_version()
+            if version is None:
+                return view(*args, **kwargs)
+            cached = cache_get(key, version, ttl)
+            if cached is not None:
+                return app.response_class(cached, mimetype='application/json', headers={'X-Cache': 'HIT'})
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                if response.is_streamed:
+                    response.response = cache_when_streamed(response.response, key, version, ttl)
+                else:
+                    cache_set(key, version, ttl, response.get_data())
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_get(key, version, ttl):
+    """Return the cached response body for key at the given graph version, or None if it is not cached."""
+    memo_version, expires, data = response_memo.get(key, (None, 0, None))
+    if memo_version == version and time.monotonic() < expires:
+        return data
+    if cache is None:
+        return None
+    try:
+        with cache.pipeline() as pipe:
+            data, ttl_ms = pipe.get(f'{key}:{version}').pttl(f'{key}:{version}').execute()
+    except redis.RedisError:
+        return None
+    if data is not None:
+        # Kept in memory only until it expires from Redis
+        response_memo[key] = (version, time.monotonic() + (ttl_ms / 1000 if ttl_ms > 0 else ttl), data)
+    return data
+
+
+def cache_set(key, version, ttl, data):
+    """Store a response body in the cache, ignoring any Redis error (it will be read from the database next time)."""
+    # Replaced as one tuple, so threads never see a body with the wrong version
+    response_memo[key] = (version, time.monotonic() + ttl, data)
+    if cache is None:
+        return
+    try:
+        cache.setex(f'{key}:{version}', ttl, data)
+    except redis.RedisError:
+        pass
+
+
+def cache_when_streamed(chunks, key, version, ttl):
+    """Yield the chunks of a streamed response, then store the whole response in the cache.
+    A response larger than CACHE_MAX_BYTES is not cached, so its chunks are no longer kept once it reaches that size.
+    """
+    streamed = []
+    size = 0
+    for chunk in chunks:
+        if streamed is not None:
+            size += len(chunk)
+            if size > CACHE_MAX_BYTES:
+                streamed = None
+            else:
+                streamed.append(chunk)
+        yield chunk
+    if streamed is not None:
+        cache_set(key, version, ttl, b''.join(streamed))
+
+
+def conditional_get(view):
+    """Decorate a view to send a weak ETag (from the graph version and any id) and respond to a matching
+    If-None-Match header with 304 Not Modified, without calling the view.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = graph_version()
+        if version is None:
+            return view(*args, **kwargs)
+        etag = version if kwargs.get('id') is None else f'{version}-{kwargs["id"]}'
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        return response
+    return wrapper
+
+
 @app.route('/')
 def welcome():
     return '<p>Welcome to Graph Explorer!</p><p>View the  <a href="/apidocs">API documentation</a>'
 
 
 '''
-The API has a wrapper which defines the Flask route and identifies the noun and method for the request.
-The wrapper then allocates the request to the appropriate function (for the noun and method).
+Each noun and method has its own Flask route, so the request is allocated to the appropriate function by
+Werkzeug's URL map (with the id already converted to an int) rather than by comparing the noun and method.
 This architecture allows these unit-tested functions to be reused by other routes in the future.
 '''
 def get_graph():
-    """Return the entire graph in the format required by vue-d3 network in the frontend."""
-    return {
-        'nodes': [{'id': r.id, 'name': r.name, '_color': r.color} for r in db.session.query(Node).all()],
-        'edges': [
-            {'id': r.id, 'sid': r.sid, 'tid': r.tid, 'name': r.name, '_color': r.color} for r in
-            db.session.query(Edge).all()
-        ]
+    """Return the entire graph in the format required by vue-d3 network in the frontend.
+    Only the required columns are selected (as Core rows) to skip building ORM objects for every node and edge.
+    The graph is kept until the graph version changes (for up to GRAPH_CACHE_TTL), so the caller must not modify it.
+    """
+    global graph_memo
+    version = graph_version()
+    memo_version, expires, graph = graph_memo
+    if version is not None and memo_version == version and time.monotonic() < expires:
+        return graph
+    nodes = db.session.execute(select_nodes).fetchall()
+    edges = db.session.execute(select_edges).fetchall()
+    graph = {
+        'nodes': [{'id': r[0], 'name': r[1], '_color': r[2]} for r in nodes],
+        'edges': [{'id': r[0], 'sid': r[1], 'tid': r[2], 'name': r[3], '_color': r[4]} for r in edges]
     }
+    # Replaced as one tuple, so threads never see a graph with the wrong version
+    graph_memo = (version, time.monotonic() + GRAPH_CACHE_TTL, graph)
+    return graph
+
+
+def stream_rows(statement, row_dict):
+    """Yield the rows of a query as comma-separated JSON objects, fetching and encoding STREAM_BATCH_SIZE at a time."""
+    result = db.session.execute(statement)
+    separator = b''
+    while True:
+        rows = result.fetchmany(STREAM_BATCH_SIZE)
+        if not rows:
+            break
+        yield separator + orjson.dumps([row_dict(r) for r in rows])[1:-1]  # Without the [ and ] of the list
+        separator = b','
+
+
+def stream_graph():
+    """Yield the entire graph as JSON (in the same format as get_graph), without holding it all in memory."""
+    yield b'{"nodes":['
+    yield from stream_rows(select_nodes, lambda r: {'id': r[0], 'name': r[1], '_color': r[2]})
+    yield b'],"edges":['
+    yield from stream_rows(select_edges, lambda r: {'id': r[0], 'sid': r[1], 'tid': r[2], 'name': r[3], '_color': r[4]})
+    yield b']}'
 
 
 @app.route('/api/v0/graph')
+@conditional_get
+@cache_response(key=GRAPH_CACHE_KEY, ttl=GRAPH_CACHE_TTL)
 def graph():
     """Get the entire graph of nodes and edges
     ---
@@ -177,18 +562,139 @@ def graph():
     responses:
       200:
         description: An object containing a list of nodes and ed.
+        headers:
+          ETag:
+            description: A weak ETag which changes whenever any node or edge changes
+            schema:
+              type: string
+          X-Cache:
+            description: HIT if the graph was served from the cache, otherwise MISS
+            schema:
+              type: string
+        content:
+          application/json:
+            schema:
+              $ref: '#/components/schemas/graph'
+      304:
+        description: The graph has not changed since the ETag sent in the If-None-Match header.
+    """
+    return app.response_class(stream_with_context(stream_graph()), mimetype='application/json')
+
+
+@app.route('/api/v0/graph', methods=['POST'])
+def graph_post():
+    """Create many nodes and edges
+    ---
+    description: >
+      Create many nodes and edges in a single transaction.
+      Each new node may include a temp_id chosen by the client, which new edges can use as their sid or tid.
+      Any other sid or tid must be the id of an existing node.
+    requestBody:
+      description: The new nodes and edges
+      required: true
+      content:
+        application/json:
+          schema:
+            $ref: '#/components/schemas/graph'
+    responses:
+      201:
+        description: The nodes and edges have successfully been created (each node includes its temp_id, if sent).
         content:
           application/json:
             schema:
               $ref: '#/components/schemas/graph'
+      400:
+        description: >
+          The request body is not a JSON object, the nodes or edges are not lists of objects, a temp_id is not a
+          string or is used twice, an edge has a sid or tid which is not the id of a node or the temp_id of a new
+          node, or a name is already used (by an existing node or edge, or twice in the request).
+        content:
+          text/plain:
+            schema:
+              type: string
+      501:
+        description: Internal server error.
+        content:
+          text/plain:
+            schema:
+              type: string
     """
-    if request.method == 'OPTIONS':
-        # This is a CORS preflight request
-        return {}, 200
-    return get_graph(), 200
+    # Get the data in the request (cleaned to prevent XSS)
+    data = request_data()
+    if data is None:
+        return NOT_AN_OBJECT, 400
+    try:
+        new_nodes = data.get('nodes') or []
+        new_edges = data.get('edges') or []
+        if not all(isinstance(items, list) and all(isinstance(i, dict) for i in items)
+                   for items in (new_nodes, new_edges)):
+            return 'Sorry, the nodes and edges must be lists of objects.', 400
+        # A temp_id must be a string, so it can never be mistaken for the id of an existing node
+        new_temp_ids = [n['temp_id'] for n in new_nodes if n.get('temp_id') is not None]
+        if any(type(t) is not str for t in new_temp_ids):
+            return 'Sorry, a temp_id must be a string.', 400
+        if len(set(new_temp_ids)) < len(new_temp_ids):
+            return 'Sorry, each temp_id must be unique.', 400
+        # Reserve the ids of the new nodes first, so they can be mapped to their temp_ids whatever the order of the
+        # rows Postgres inserts or returns
+        ids = sorted(r[0] for r in db.session.execute(next_node_ids, {'n': len(new_nodes)})) if new_nodes else []
+        node_rows = [
+            {
+                'id': id,
+                'name': sanitize(n.get('name')),
+                'color': valid_color(n.get('_color'))
+            } for id, n in zip(ids, new_nodes)
+        ]
+        for batch in range(0, len(node_rows), BULK_BATCH_SIZE):
+            try:
+                db.session.execute(db.insert(Node).values(node_rows[batch:batch + BULK_BATCH_SIZE]))
+            except IntegrityError as e:
+                return duplicate_name_response(e)
+        # Map the client's temp_ids to the ids of the new nodes
+        temp_ids = {n['temp_id']: id for id, n in zip(ids, new_nodes) if n.get('temp_id') is not None}
+        edge_rows = []
+        existing_ids = set()  # The ids of existing nodes used by the new edges
+        for e in new_edges:
+            node_ids = (e.get('sid'), e.get('tid'))
+            existing_ids.update(i for i in node_ids if type(i) is int)
+            sid, tid = (temp_ids.get(i) if type(i) is str else i for i in node_ids)
+            if not (type(sid) is int and type(tid) is int):
+                db.session.rollback()
+                return 'Sorry, the sid and tid params must be integers or the temp_id of a new node.', 400
+            edge_rows.append({
+                'sid': sid,
+                'tid': tid,
+                'name': sanitize(e.get('name')),
+                'color': valid_color(e.get('_color'))
+            })
+        missing = missing_node_ids(existing_ids)
+        if missing:
+            db.session.rollback()
+            return NO_NODE % ', '.join(map(str, missing)), 400
+        edges = []
+        for batch in range(0, len(edge_rows), BULK_BATCH_SIZE):
+            try:
+                edges += db.session.execute(
+                    db.insert(Edge).values(edge_rows[batch:batch + BULK_BATCH_SIZE])
+                    .returning(Edge.id, Edge.sid, Edge.tid, Edge.name, Edge.color)
+                ).fetchall()
+            except IntegrityError as e:
+                return duplicate_name_response(e)
+        db.session.commit()
+        response_nodes = [{'id': r['id'], 'name': r['name'], '_color': r['color']} for r in node_rows]
+        for node, n in zip(response_nodes, new_nodes):
+            if n.get('temp_id') is not None:
+                node['temp_id'] = n['temp_id']
+        return json_response({
+            'nodes': response_nodes,
+            'edges': [{'id': r[0], 'sid': r[1], 'tid': r[2], 'name': r[3], '_color': r[4]} for r in edges]
+        }, 201)
+    except Exception as e:
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/node/<int:id>', methods=['GET'])
+@conditional_get
 def node_get(id):
     """Get a node
     ---
@@ -207,6 +713,8 @@ def node_get(id):
           application/json:
             schema:
               $ref: '#/components/schemas/node'
+      304:
+        description: The node has not changed since the ETag sent in the If-None-Match header.
       404:
         description: The node does not exist
         content:
@@ -216,12 +724,12 @@ def node_get(id):
 
     """
     try:
-        node = db.session.query(Node).filter_by(id=id).first()
+        node = db.session.query(Node).get(id)
         if node:
-            return {'id': node.id, 'name': node.name, '_color': node.color}
-        return f'Sorry, there is no node with id {id}', 404
+            return json_response(node_dict(node))
+        return NO_NODE % id, 404
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/node', methods=['POST'])
@@ -229,6 +737,13 @@ def node_post():
     """Create a new node
     ---
     description: Create a new node
+    parameters:
+      - name: full
+        in: query
+        description: Set to 1 to return the entire graph (with status 200 for a delete) instead
+        required: false
+        schema:
+          type: integer
     requestBody:
       description: Optional data describing the new node
       required: false
@@ -242,10 +757,10 @@ def node_post():
         content:
           application/json:
             schema:
-              $ref: '#/components/schemas/graph'
+              $ref: '#/components/schemas/node'
 
       400:
-        description: A node with the same name already exists.
+        description: The request body is not a JSON object, or a node with the same name already exists.
         content:
           text/plain:
             schema:
@@ -260,19 +775,22 @@ def node_post():
     """
     # Clean the posted data to prevent XSS
     # Get the data in the request (cleaned to prevent XSS)
+    data = request_data()
+    if data is None:
+        return NOT_AN_OBJECT, 400
     try:
-        name = clean(request.json.get('name') or '') or None
-        color = valid_color(clean(request.json.get('_color') or '') or None)
-        # Check whether there's an existing node with this name
-        node_existing = db.session.query(Node).filter_by(name=name).first()
-        if node_existing:
-            return f'Sorry, a node with the name \'{name}\' already exists. Please change the name and try again.', 400
+        name = sanitize(data.get('name'))
+        color = valid_color(data.get('_color'))
         node = Node(name=name, color=color)
         db.session.add(node)
-        db.session.commit()
-        return get_graph(), 201
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            # The unique index on name rejects a duplicate without a separate query to check for one
+            return duplicate_name_response(e, DUPLICATE_NODE % name)
+        return mutation_response(node_dict(node), 201, {'Location': f'/api/v0/node/{node.id}'})
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/node/<int:id>', methods=['PUT'])
@@ -287,6 +805,12 @@ def node_put(id):
         required: true
         schema:
           type: integer
+      - name: full
+        in: query
+        description: Set to 1 to return the entire graph (with status 200 for a delete) instead
+        required: false
+        schema:
+          type: integer
     requestBody:
       description: Optional data describing the new node
       required: false
@@ -300,13 +824,19 @@ def node_put(id):
         content:
           application/json:
             schema:
-              $ref: '#/components/schemas/graph'
+              $ref: '#/components/schemas/node'
       201:
         description: The node has successfully been created.
         content:
           application/json:
             schema:
-              $ref: '#/components/schemas/graph'
+              $ref: '#/components/schemas/node'
+      400:
+        description: The request body is not a JSON object.
+        content:
+          text/plain:
+            schema:
+              type: string
       501:
         description: Internal server error.
         content:
@@ -315,27 +845,32 @@ def node_put(id):
               type: string
     """
     # Get the data in the request (cleaned to prevent XSS)
+    data = request_data()
+    if data is None:
+        return NOT_AN_OBJECT, 400
     try:
         # Check whether the node exists
-        node = db.session.query(Node).filter_by(id=id).first()
+        node = db.session.query(Node).get(id)
         if node:
             # Update only the parameters provided in the request data
-            if 'name' in request.json:
-                node.name = clean(request.json.get('name') or '') or None
-            if '_color' in request.json:
-                node.color = valid_color(clean(request.json.get('_color') or '') or None)
+            name = data.get('name', MISSING)
+            if name is not MISSING:
+                node.name = sanitize(name)
+            color = data.get('_color', MISSING)
+            if color is not MISSING:
+                node.color = valid_color(color)
             db.session.commit()
-            return get_graph(), 200
+            return mutation_response(node_dict(node), 200)
         else:
             # Create the node
-            name = clean(request.json.get('name') or '') or None
-            color = valid_color(clean(request.json.get('_color') or '') or None)
+            name = sanitize(data.get('name'))
+            color = valid_color(data.get('_color'))
             node = Node(id=id, name=name, color=color)
             db.session.add(node)
             db.session.commit()
-            return get_graph(), 201
+            return mutation_response(node_dict(node), 201, {'Location': f'/api/v0/node/{node.id}'})
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/node/<int:id>', methods=['DELETE'])
@@ -350,31 +885,34 @@ def node_delete(id):
         required: true
         schema:
           type: integer
+      - name: full
+        in: query
+        description: Set to 1 to return the entire graph (with status 200 for a delete) instead
+        required: false
+        schema:
+          type: integer
     responses:
-      200:
+      204:
         description: The node has been deleted.
+      404:
+        description: The node does not exist (perhaps it has already been deleted)
         content:
-          application/json:
+          text/plain:
             schema:
-              $ref: '#/components/schemas/graph'
-      404:
-        description: The node does not exist
+              type: string
     """
     try:
-        node = db.session.query(Node).filter_by(id=id).first()
-        if node:
-            try:
-                db.session.delete(node)
-                db.session.commit()
-                return get_graph(), 200
-            except Exception as e:
-                return str(e), 501
-        return f'There is no node with id={id}. Perhaps it has already been deleted?', 404
+        # A single DELETE statement (without loading the node first) - Postgres cascades the delete to its edges
+        if db.session.execute(db.delete(Node).where(Node.id == id)).rowcount:
+            db.session.commit()
+            return mutation_response('', 204)
+        return NODE_DELETED % id, 404
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/edge/<int:id>', methods=['GET'])
+@conditional_get
 def edge_get(id):
     """Get an edge
     ---
@@ -393,6 +931,8 @@ def edge_get(id):
           application/json:
             schema:
               $ref: '#/components/schemas/edge'
+      304:
+        description: The edge has not changed since the ETag sent in the If-None-Match header.
       404:
         description: The edge does not exist
         content:
@@ -401,18 +941,12 @@ def edge_get(id):
               type: string
     """
     try:
-        edge = db.session.query(Edge).filter_by(id=id).first()
+        edge = db.session.query(Edge).get(id)
         if edge:
-            return {
-                'id': edge.id,
-                'sid': edge.sid,
-                'tid': edge.tid,
-                'name': edge.name,
-                '_color': edge.color
-            }
-        return f'Sorry, there is no edge with id {id}', 404
+            return json_response(edge_dict(edge))
+        return NO_EDGE % id, 404
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/edge', methods=['POST'])
@@ -420,6 +954,13 @@ def edge_post():
     """Create a new edge
     ---
     description: Create a new edge
+    parameters:
+      - name: full
+        in: query
+        description: Set to 1 to return the entire graph (with status 200 for a delete) instead
+        required: false
+        schema:
+          type: integer
     requestBody:
       description: Optional data describing the new edge
       required: false
@@ -433,10 +974,12 @@ def edge_post():
         content:
           application/json:
             schema:
-              $ref: '#/components/schemas/graph'
+              $ref: '#/components/schemas/edge'
 
       400:
-        description: An edge with the same name already exists.
+        description: >
+          The request body is not a JSON object, an edge with the same name already exists, or the sid or tid is not
+          the id of a node.
         content:
           text/plain:
             schema:
@@ -451,16 +994,29 @@ def edge_post():
     """
     # Clean the posted data to prevent XSS
     # Get the data in the request (cleaned to prevent XSS)
+    data = request_data()
+    if data is None:
+        return NOT_AN_OBJECT, 400
     try:
-        sid = request.json.get('sid')
-        tid = request.json.get('tid')
-        name = clean(request.json.get('name') or '') or None
-        color = valid_color(clean(request.json.get('_color') or '') or None)
-        db.session.add(Edge(sid=sid, tid=tid, name=name, color=color))
-        db.session.commit()
-        return get_graph(), 201
+        sid = data.get('sid')
+        tid = data.get('tid')
+        if not (type(sid) is int and type(tid) is int):  # Not isinstance, which would accept true and false
+            return 'Sorry, the sid and tid params must be integers.', 400
+        missing = missing_node_ids([sid, tid])
+        if missing:
+            return NO_NODE % ', '.join(map(str, missing)), 400
+        name = sanitize(data.get('name'))
+        color = valid_color(data.get('_color'))
+        edge = Edge(sid=sid, tid=tid, name=name, color=color)
+        db.session.add(edge)
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            # The unique index on name rejects a duplicate without a separate query to check for one
+            return duplicate_name_response(e, DUPLICATE_EDGE % name)
+        return mutation_response(edge_dict(edge), 201, {'Location': f'/api/v0/edge/{edge.id}'})
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/edge/<int:id>', methods=['PUT'])
@@ -475,6 +1031,12 @@ def edge_put(id):
         required: true
         schema:
           type: integer
+      - name: full
+        in: query
+        description: Set to 1 to return the entire graph (with status 200 for a delete) instead
+        required: false
+        schema:
+          type: integer
     requestBody:
       description: Optional data describing the new edge
       required: false
@@ -488,13 +1050,19 @@ def edge_put(id):
         content:
           application/json:
             schema:
-              $ref: '#/components/schemas/graph'
+              $ref: '#/components/schemas/edge'
       201:
         description: The edge has successfully been created.
         content:
           application/json:
             schema:
-              $ref: '#/components/schemas/graph'
+              $ref: '#/components/schemas/edge'
+      400:
+        description: The request body is not a JSON object, or the sid or tid is not an integer or not the id of a node.
+        content:
+          text/plain:
+            schema:
+              type: string
       501:
         description: Internal server error.
         content:
@@ -503,36 +1071,49 @@ def edge_put(id):
               type: string
     """
     # Get the data in the request (cleaned to prevent XSS)
+    data = request_data()
+    if data is None:
+        return NOT_AN_OBJECT, 400
     try:
+        sid = data.get('sid')
+        tid = data.get('tid')
+        sid_is_int = type(sid) is int  # Not isinstance, which would accept true and false
+        tid_is_int = type(tid) is int
         # Check whether the edge exists
-        edge = db.session.query(Edge).filter_by(id=id).first()
+        edge = db.session.query(Edge).get(id)
         if edge:
             # Update only the parameters provided in the request data
-            if 'sid' in request.json and isinstance(request.json['sid'], int):
-                edge.sid = request.json['sid']
-            if 'tid' in request.json and isinstance(request.json['tid'], int):
-                edge.tid = request.json['tid']
-            if 'name' in request.json:
-                edge.name = clean(request.json.get('name') or '') or None
-            if '_color' in request.json:
-                edge.color = valid_color(clean(request.json.get('_color') or '') or None)
+            node_ids = [i for i, is_int in ((sid, sid_is_int), (tid, tid_is_int)) if is_int]
+            missing = missing_node_ids(node_ids)
+            if missing:
+                return NO_NODE % ', '.join(map(str, missing)), 400
+            if sid_is_int:
+                edge.sid = sid
+            if tid_is_int:
+                edge.tid = tid
+            name = data.get('name', MISSING)
+            if name is not MISSING:
+                edge.name = sanitize(name)
+            color = data.get('_color', MISSING)
+            if color is not MISSING:
+                edge.color = valid_color(color)
             db.session.commit()
-            return get_graph(), 200
+            return mutation_response(edge_dict(edge), 200)
         else:
             # Create the edge
-            if isinstance(request.json.get('sid'), int) and isinstance(request.json.get('tid'), int):
-                sid = request.json['sid']
-                tid = request.json['tid']
-            else:
+            if not (sid_is_int and tid_is_int):
                 return 'Sorry, the sid and tid params must be integers.', 400
-            name = clean(request.json.get('name') or '') or None
-            color = valid_color(clean(request.json.get('_color') or '') or None)
+            missing = missing_node_ids([sid, tid])
+            if missing:
+                return NO_NODE % ', '.join(map(str, missing)), 400
+            name = sanitize(data.get('name'))
+            color = valid_color(data.get('_color'))
             edge = Edge(id=id, sid=sid, tid=tid, name=name, color=color)
             db.session.add(edge)
             db.session.commit()
-            return get_graph(), 201
+            return mutation_response(edge_dict(edge), 201, {'Location': f'/api/v0/edge/{edge.id}'})
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
 @app.route('/api/v0/edge/<int:id>', methods=['DELETE'])
@@ -547,39 +1128,47 @@ def edge_delete(id):
         required: true
         schema:
           type: integer
+      - name: full
+        in: query
+        description: Set to 1 to return the entire graph (with status 200 for a delete) instead
+        required: false
+        schema:
+          type: integer
     responses:
-      200:
+      204:
         description: The edge has been deleted.
+      404:
+        description: The edge does not exist (perhaps it has already been deleted)
         content:
-          application/json:
+          text/plain:
             schema:
-              $ref: '#/components/schemas/graph'
-      404:
-        description: The edge does not exist
+              type: string
     """
     try:
-        edge = db.session.query(Edge).filter_by(id=id).first()
-        if edge:
-            try:
-                db.session.delete(edge)
-                db.session.commit()
-                return get_graph(), 200
-            except Exception as e:
-                return str(e), 501
-        return f'There is no edge with id={id}. Perhaps it has already been deleted?', 404
+        # A single DELETE statement (without loading the edge first)
+        if db.session.execute(db.delete(Edge).where(Edge.id == id)).rowcount:
+            db.session.commit()
+            return mutation_response('', 204)
+        return EDGE_DELETED % id, 404
     except Exception as e:
-        return f'Sorry, there was an exception: {e}', 501
+        return EXCEPTION % e, 501
 
 
-@app.route('/api/v0/<noun>', methods=['OPTIONS'])
-@app.route('/api/v0/<noun>/<int:id>', methods=['OPTIONS'])
-def api_cors_preflight(noun, id):
-    """For performance, return empty responses to CORS preflight requests (to avoid database calls)
-    :return:
-    """
-    if noun in ['node', 'edge']:
-        return {}, 200
+# The OpenAPI spec only changes with the code, so build and encode it once (flasgger rebuilds it for each request)
+with app.test_request_context():
+    apispec = orjson.dumps(swagger.get_apispecs('apispec_1'), option=orjson.OPT_NON_STR_KEYS)
+
+
+def apispec_1():
+    """Serve the pre-built OpenAPI spec in place of flasgger's view."""
+    return app.response_class(apispec, mimetype='application/json')
+
+
+app.view_functions['flasgger.apispec_1'] = apispec_1
 
 
 if __name__ == '__main__':
+    # Flask's server handles one request at a time, so only use it for development (the Procfile runs gunicorn)
+    if os.environ.get('FLASK_ENV') != 'development':
+        raise SystemExit('Run the API with gunicorn (see the Procfile), or set FLASK_ENV=development')
     app.run()
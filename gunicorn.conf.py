@@ -0,0 +1,24 @@
+"""Settings for gunicorn (the web server in the Procfile)"""
+
+import multiprocessing
+import os
+
+# The Postgres connections this dyno may open (Heroku's hobby plans allow 20 in total), shared between the workers
+max_connections = int(os.environ.get('DATABASE_MAX_CONNECTIONS', 20))
+
+# Each gevent worker serves many requests at once, switching between them while they wait for Postgres or Redis,
+# so a few workers (each with a real pool of connections) are enough to use the CPUs
+worker_class = 'gevent'
+workers = max(1, min(int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4))), max_connections))
+# All the pools together stay within max_connections
+pool_size = max_connections // workers
+# A worker accepts more requests than its pool has connections: the extra ones wait (up to SQLAlchemy's
+# pool_timeout) for a connection to be returned, and some (e.g. for a graph cached in Redis) need none at all
+worker_connections = 4 * pool_size
+raw_env = [f'DATABASE_POOL_SIZE={pool_size}']  # Read by app.py
+
+
+def post_fork(server, worker):
+    """Make psycopg2 wait for Postgres without blocking the worker's other requests (before the app is loaded)"""
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
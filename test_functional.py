@@ -10,9 +10,10 @@ format pytest results into Test Anything Protocol so that Heroku CI can interpre
 
 """
 
-from app import app, db, Edge, Node
+from app import app, db, Edge, graph_changed, Node
 from faker import Faker
 import pytest
+from sqlalchemy import event
 
 # New node/edge data
 sid = 3
@@ -20,31 +21,53 @@ tid = 6
 name = 'foo'
 color = '#000000'
 
+fake = Faker()
 
-@pytest.fixture
-def client():
-    """Load data for tests and return a Flask test_client"""
-    app.debug = True
+
+@pytest.fixture(scope='session')
+def seed():
+    """Load data for tests (once per test session)"""
     db.create_all()
-    db.session.execute('DELETE FROM node;')  # Edge deletes will cascade
-    fake = Faker()
-    for n in range(1, 11):
-        db.session.add(Node(id=n, name=f'Node{n}', color=fake.hex_color()))
+    db.session.execute(db.text('TRUNCATE node, edge RESTART IDENTITY CASCADE'))
+    db.session.execute(db.insert(Node.__table__), [
+        {'id': n, 'name': f'Node{n}', 'color': fake.hex_color()} for n in range(1, 11)
+    ])
+    db.session.execute(db.insert(Edge.__table__), [
+        {'sid': e, 'tid': e+1, 'name': f'Edge-{e}-{e+1}', 'color': fake.hex_color()} for e in range(1, 10)
+    ])
     db.session.commit()
-    db.session.execute('ALTER SEQUENCE node_id_seq RESTART WITH 11;')
-    db.session.execute('ALTER SEQUENCE edge_id_seq RESTART WITH 1;')
-    for e in range(1, 10):
-        db.session.add(Edge(sid=e, tid=e+1, name=f'Edge-{e}-{e+1}', color=fake.hex_color()))
-    db.session.commit()
-    return app.test_client()
+    db.session.remove()
+
+
+@pytest.fixture
+def client(seed):
+    """Return a Flask test_client, rolling back any changes the test made to the data afterwards"""
+    app.debug = True
+    connection = db.engine.connect()
+    connection.begin()
+    # Sequences are not rolled back, so restart them in every test (the seed data uses ids 1-10 and 1-9)
+    connection.execute(db.text('ALTER SEQUENCE node_id_seq RESTART WITH 11'))
+    connection.execute(db.text('ALTER SEQUENCE edge_id_seq RESTART WITH 10'))
+    connection.begin_nested()
+    session = db.create_scoped_session(options={'bind': connection, 'binds': {}})
+
+    # The app's transactions become part of a SAVEPOINT, so a rollback by the app only undoes its own changes
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(session, session_transaction):
+        if session_transaction.parent is None:
+            connection.begin_nested()
+
+    app_session, db.session = db.session, session
+    yield app.test_client()
+    db.session = app_session
+    session.remove()
+    connection.close()  # Rolls back the transaction, with every change made during the test
+    graph_changed(None)  # So no response cached during the test is served for the rolled back data
 
 
 def return_item_with_id(list_of_dictionaries, id):
     """Returns a dictionary with nominated id (from a list of dictionaries)"""
-    for dictionary in list_of_dictionaries:
-        if dictionary.get('id') == id:
-            return dictionary
-    return None
+    return {dictionary['id']: dictionary for dictionary in list_of_dictionaries if 'id' in dictionary}.get(id)
 
 
 def test_graph_get(client):
@@ -54,6 +77,84 @@ def test_graph_get(client):
     assert len(response.json['edges']) == 9
 
 
+def test_graph_get_not_modified(client):
+    etag = client.get('/api/v0/graph').headers['ETag']
+    response = client.get('/api/v0/graph', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    client.post('/api/v0/node', json={'name': name})
+    response = client.get('/api/v0/graph', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_graph_get_cached(client):
+    response = client.get('/api/v0/graph')
+    assert response.headers['X-Cache'] == 'MISS'
+    graph = response.json  # The response is cached once its body has been streamed
+    cached = client.get('/api/v0/graph')
+    assert cached.headers['X-Cache'] == 'HIT'
+    assert cached.json == graph
+    client.post('/api/v0/node', json={'name': name})
+    response = client.get('/api/v0/graph')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert len(response.json['nodes']) == 11
+
+
+def test_graph_changed_outside_request(client):
+    response = client.get('/api/v0/graph')
+    response.get_data()  # Finish the streamed response, which ends its request
+    with app.app_context():  # e.g. a script or flask shell
+        db.session.add(Node(name=name))
+        db.session.commit()
+    response = client.get('/api/v0/graph', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+    assert len(response.json['nodes']) == 11
+
+
+def test_graph_post(client):
+    response = client.post('/api/v0/graph', json={
+        'nodes': [{'temp_id': 'a', 'name': name, '_color': color}, {'temp_id': 'b'}],
+        'edges': [{'sid': 'a', 'tid': 'b', 'name': name}, {'sid': 'b', 'tid': 1}]
+    })
+    assert response.status_code == 201
+    assert [n['id'] for n in response.json['nodes']] == [11, 12]
+    assert response.json['nodes'][0]['temp_id'] == 'a'
+    assert response.json['nodes'][0]['_color'] == color
+    assert response.json['edges'][0]['sid'] == 11
+    assert response.json['edges'][0]['tid'] == 12
+    assert response.json['edges'][1]['sid'] == 12
+    assert response.json['edges'][1]['tid'] == 1
+    graph = client.get('/api/v0/graph').json
+    assert len(graph['nodes']) == 12
+    assert len(graph['edges']) == 11
+
+
+def test_graph_post_invalid(client):
+    # An integer temp_id could be mistaken for the id of an existing node
+    response = client.post('/api/v0/graph', json={'nodes': [{'temp_id': 1}], 'edges': [{'sid': 1, 'tid': 2}]})
+    assert response.status_code == 400
+    response = client.post('/api/v0/graph', json={'nodes': [{'temp_id': 'a'}], 'edges': [{'sid': ['a'], 'tid': 2}]})
+    assert response.status_code == 400
+    response = client.post('/api/v0/graph', json={'nodes': [{'temp_id': 'a'}, {'temp_id': 'a'}]})
+    assert response.status_code == 400
+    assert client.post('/api/v0/graph', json={'nodes': {'temp_id': 'a'}}).status_code == 400
+    assert client.post('/api/v0/graph', json={'nodes': ['a']}).status_code == 400
+    assert client.post('/api/v0/graph', json={'edges': [[1, 2]]}).status_code == 400
+    response = client.post('/api/v0/graph', json={'nodes': [{'name': name}, {'name': name}]})
+    assert response.status_code == 400
+    response = client.post('/api/v0/graph', json={'edges': [{'sid': 1, 'tid': 2, 'name': 'Edge-1-2'}]})
+    assert response.status_code == 400
+    assert 'edge' in response.get_data(as_text=True)
+    assert len(client.get('/api/v0/graph').json['nodes']) == 10
+
+
+def test_graph_post_id_collision(client):
+    # A node created with an explicit id collides with the sequence, which is not a duplicate name
+    client.put('/api/v0/node/11', json={})
+    response = client.post('/api/v0/graph', json={'nodes': [{'name': name}]})
+    assert response.status_code == 501
+
+
 def test_node_get(client):
     response = client.get('/api/v0/node/1')
     assert response.status_code == 200
@@ -65,14 +166,44 @@ def test_node_get(client):
 def test_node_post(client):
     response = client.post('/api/v0/node', json={'name': name, '_color': color})
     assert response.status_code == 201
+    assert response.json['id'] == 11
+    assert response.json['name'] == name
+    assert response.json['_color'] == color
+    assert response.headers['Location'].endswith('/api/v0/node/11')
+    assert len(client.get('/api/v0/graph').json['nodes']) == 11
+
+
+def test_node_post_full_graph(client):
+    response = client.post('/api/v0/node?full=1', json={'name': name, '_color': color})
+    assert response.status_code == 201
     assert len(response.json['nodes']) == 11
-    assert response.json['nodes'][10]['name'] == name
-    assert response.json['nodes'][10]['_color'] == color
+    assert return_item_with_id(response.json['nodes'], 11)['name'] == name
+
+
+def test_node_post_duplicate_name(client):
+    response = client.post('/api/v0/node', json={'name': 'Node1'})
+    assert response.status_code == 400
+    assert len(client.get('/api/v0/graph').json['nodes']) == 10
+
+
+def test_node_post_id_collision(client):
+    # A node created with an explicit id collides with the sequence, which is not a duplicate name
+    client.put('/api/v0/node/11', json={})
+    response = client.post('/api/v0/node', json={'name': name})
+    assert response.status_code == 501
+
+
+def test_node_post_invalid_body(client):
+    assert client.post('/api/v0/node', data='{bad json', content_type='application/json').status_code == 400
+    assert client.post('/api/v0/node', data={'name': name}).status_code == 400  # A form
+    assert client.post('/api/v0/node', json=[name]).status_code == 400
+    assert len(client.get('/api/v0/graph').json['nodes']) == 10
+    assert client.post('/api/v0/node').status_code == 201  # No body: a node with no name or color
 
 
 def test_node_put(client):
     response = client.put('/api/v0/node/1', json={'name': name, '_color': color})
-    updated_node = return_item_with_id(response.json['nodes'], 1)
+    updated_node = response.json
     assert response.status_code == 200
     assert updated_node['name'] == name
     assert updated_node['_color'] == color
@@ -81,7 +212,7 @@ def test_node_put(client):
 def test_node_put_partial_1(client):
     existing_node_data = client.get('/api/v0/node/1').json
     response = client.put('/api/v0/node/1', json={'name': name})
-    updated_node = return_item_with_id(response.json['nodes'], 1)
+    updated_node = response.json
     assert response.status_code == 200
     assert updated_node['name'] == name
     assert updated_node['_color'] == existing_node_data['_color']
@@ -90,7 +221,7 @@ def test_node_put_partial_1(client):
 def test_node_put_partial_2(client):
     existing_node_data = client.get('/api/v0/node/1').json
     response = client.put('/api/v0/node/1', json={'_color': color})
-    updated_node = return_item_with_id(response.json['nodes'], 1)
+    updated_node = response.json
     assert response.status_code == 200
     assert updated_node['name'] == existing_node_data['name']
     assert updated_node['_color'] == color
@@ -98,9 +229,10 @@ def test_node_put_partial_2(client):
 
 def test_node_delete(client):
     response = client.delete('/api/v0/node/1')
-    assert response.status_code == 200
-    assert len(response.json['nodes']) == 9
-    assert return_item_with_id(response.json['edges'], 1) == None
+    assert response.status_code == 204
+    graph = client.get('/api/v0/graph').json
+    assert len(graph['nodes']) == 9
+    assert return_item_with_id(graph['edges'], 1) == None
 
 
 def test_edge_get(client):
@@ -115,9 +247,10 @@ def test_edge_get(client):
 
 def test_edge_post(client):
     response = client.post('/api/v0/edge', json={'sid': sid, 'tid': tid, 'name': name, '_color': color})
-    new_edge = return_item_with_id(response.json['edges'], 10)
+    new_edge = response.json
     assert response.status_code == 201
-    assert len(response.json['edges']) == 10
+    assert new_edge['id'] == 10
+    assert len(client.get('/api/v0/graph').json['edges']) == 10
     assert new_edge['sid'] == sid
     assert new_edge['tid'] == tid
     assert new_edge['name'] == name
@@ -126,18 +259,30 @@ def test_edge_post(client):
 
 def test_edge_post_no_other_data(client):
     response = client.post('/api/v0/edge', json={'sid': sid, 'tid': tid})
-    new_edge = return_item_with_id(response.json['edges'], 10)
+    new_edge = response.json
     assert response.status_code == 201
-    assert len(response.json['edges']) == 10
+    assert new_edge['id'] == 10
     assert new_edge['sid'] == sid
     assert new_edge['tid'] == tid
     assert new_edge['name'] is None
     assert new_edge['_color'] is None
 
 
+def test_edge_post_missing_node(client):
+    response = client.post('/api/v0/edge', json={'sid': sid, 'tid': 99})
+    assert response.status_code == 400
+    assert len(client.get('/api/v0/graph').json['edges']) == 9
+
+
+def test_edge_post_duplicate_name(client):
+    response = client.post('/api/v0/edge', json={'sid': sid, 'tid': tid, 'name': 'Edge-1-2'})
+    assert response.status_code == 400
+    assert len(client.get('/api/v0/graph').json['edges']) == 9
+
+
 def test_edge_put(client):
     response = client.put('/api/v0/edge/1', json={'sid': sid, 'tid': tid, 'name': name, '_color': color})
-    updated_edge = return_item_with_id(response.json['edges'], 1)
+    updated_edge = response.json
     assert response.status_code == 200
     assert updated_edge['sid'] == sid
     assert updated_edge['tid'] == tid
@@ -148,7 +293,7 @@ def test_edge_put(client):
 def test_edge_put_partial_1(client):
     existing_edge_data = client.get('/api/v0/edge/1').json
     response = client.put('/api/v0/edge/1', json={'sid': sid, 'name': name})
-    updated_edge = return_item_with_id(response.json['edges'], 1)
+    updated_edge = response.json
     assert response.status_code == 200
     assert updated_edge['sid'] == sid
     assert updated_edge['tid'] == existing_edge_data['tid']
@@ -159,7 +304,7 @@ def test_edge_put_partial_1(client):
 def test_edge_put_partial_2(client):
     existing_node_data = client.get('/api/v0/edge/1').json
     response = client.put('/api/v0/edge/1', json={'tid': tid, '_color': color})
-    updated_edge = return_item_with_id(response.json['edges'], 1)
+    updated_edge = response.json
     assert response.status_code == 200
     assert updated_edge['sid'] == existing_node_data['sid']
     assert updated_edge['tid'] == tid
@@ -167,11 +312,31 @@ def test_edge_put_partial_2(client):
     assert updated_edge['_color'] == color
 
 
+def test_edge_put_boolean_node_id(client):
+    response = client.put('/api/v0/edge/20', json={'sid': True, 'tid': tid})
+    assert response.status_code == 400
+    response = client.put('/api/v0/edge/2', json={'sid': True})
+    assert response.status_code == 200
+    assert response.json['sid'] == 2  # Unchanged, rather than set to node 1
+
+
 def test_edge_delete(client):
     response = client.delete('/api/v0/edge/1')
+    assert response.status_code == 204
+    graph = client.get('/api/v0/graph').json
+    assert len(graph['edges']) == 8
+    assert return_item_with_id(graph['edges'], 1) == None
+
+
+def test_cors_preflight(client):
+    response = client.options('/api/v0/node/1', headers={
+        'Origin': 'http://localhost:8080',
+        'Access-Control-Request-Method': 'PUT'
+    })
     assert response.status_code == 200
-    assert len(response.json['edges']) == 8
-    assert return_item_with_id(response.json['edges'], 1) == None
+    assert response.headers['Access-Control-Allow-Origin'] == 'http://localhost:8080'
+    assert 'PUT' in response.headers['Access-Control-Allow-Methods']
+    assert response.headers['Access-Control-Max-Age'] == '86400'
 
 
 def test_swag(client):